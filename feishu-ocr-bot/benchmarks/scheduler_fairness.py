@@ -0,0 +1,82 @@
+"""
+多会话公平性基准：一个会话一次提交大量任务，其他会话随后各提交少量任务，
+比较全局先进先出队列与 ChatScheduler 下各会话的完成时间
+
+运行方式（在 feishu-ocr-bot 目录下）：
+    python -m benchmarks.scheduler_fairness
+"""
+import asyncio
+import time
+from typing import Dict, List, Tuple
+
+from src.chat_scheduler import ChatScheduler
+
+WORKERS = 4
+JOB_SECONDS = 0.02
+BULK_JOBS = 50
+SMALL_CHATS = 4
+SMALL_JOBS = 3
+
+
+def build_workload() -> List[Tuple[str, int]]:
+    jobs = [("bulk", i) for i in range(BULK_JOBS)]
+    for chat in range(SMALL_CHATS):
+        jobs.extend((f"chat-{chat}", i) for i in range(SMALL_JOBS))
+    return jobs
+
+
+async def run_fifo(workload: List[Tuple[str, int]]) -> Dict[str, float]:
+    """所有任务进入同一个队列，由固定数量的工作协程按到达顺序处理"""
+    queue: asyncio.Queue = asyncio.Queue()
+    finished: Dict[str, float] = {}
+    start = time.perf_counter()
+
+    async def worker():
+        while True:
+            chat_id, _ = await queue.get()
+            await asyncio.sleep(JOB_SECONDS)
+            finished[chat_id] = time.perf_counter() - start
+            queue.task_done()
+
+    for item in workload:
+        queue.put_nowait(item)
+    workers = [asyncio.create_task(worker()) for _ in range(WORKERS)]
+    await queue.join()
+    for task in workers:
+        task.cancel()
+    return finished
+
+
+async def run_scheduler(workload: List[Tuple[str, int]]) -> Tuple[Dict[str, float], Dict]:
+    scheduler = ChatScheduler(workers=WORKERS, max_queue_per_chat=BULK_JOBS)
+    finished: Dict[str, float] = {}
+    start = time.perf_counter()
+
+    def make_job(chat_id: str):
+        async def job():
+            await asyncio.sleep(JOB_SECONDS)
+            finished[chat_id] = time.perf_counter() - start
+        return job
+
+    for chat_id, _ in workload:
+        scheduler.submit(chat_id, make_job(chat_id))
+    stats = scheduler.stats()
+    await scheduler.close()
+    return finished, stats
+
+
+async def main() -> None:
+    workload = build_workload()
+    fifo = await run_fifo(workload)
+    fair, stats = await run_scheduler(workload)
+
+    print(f"{len(workload)} 个任务，{WORKERS} 个工作协程，每个任务 {JOB_SECONDS * 1000:.0f}ms")
+    print(f"{'会话':<10}{'任务数':>8}{'FIFO 完成(s)':>16}{'调度器完成(s)':>16}{'提交时队列深度':>16}")
+    for chat_id in sorted(fifo, key=lambda c: (c != "bulk", c)):
+        count = BULK_JOBS if chat_id == "bulk" else SMALL_JOBS
+        depth = stats["chats"][chat_id]["queue_depth"]
+        print(f"{chat_id:<10}{count:>8}{fifo[chat_id]:>16.3f}{fair[chat_id]:>16.3f}{depth:>16}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -3,7 +3,11 @@ class Config:
     FEISHU_APP_ID = "your-app-id"  # 飞书应用 App ID
     FEISHU_APP_SECRET = "your-app-secret"  # 飞书应用 App Secret
     FEISHU_VERIFICATION_TOKEN = "your-verification-token"  # 飞书事件订阅的 Verification Token
-    FEISHU_ENCRYPT_KEY = "your-encrypt-key"  # 飞书事件订阅的加密密钥
+    FEISHU_ENCRYPT_KEY = ""  # 飞书事件订阅的 Encrypt Key，须与开发者后台一致；留空则不校验签名
+    FEISHU_MAX_BODY_BYTES = 64 * 1024  # 回调请求体大小上限（字节）
+    FEISHU_REPLAY_WINDOW_SECONDS = 300  # 回调请求时间戳允许的偏差（秒），同时作为防重放窗口
+    FEISHU_REPLAY_CACHE_SIZE = 10000  # 防重放缓存的最大条目数
+    FEISHU_TOKEN_REFRESH_MARGIN = 300  # tenant_access_token 提前刷新的时间（秒）
 
     # Obsidian Vault 配置
     OBSIDIAN_VAULT_PATH = "/path/to/your/vault"  # Obsidian vault 根目录
@@ -11,6 +15,17 @@ class Config:
     OBSIDIAN_SYNC_DIR = "sync"  # 同步目录
     OBSIDIAN_ENABLED = True  # 是否启用 Obsidian 同步
 
+    # 远程图片缓存配置（OCR 结果中的远程图片按 URL 缓存，跨笔记复用）
+    ATTACHMENT_CACHE_ENABLED = True  # 是否启用远程图片缓存
+    ATTACHMENT_CACHE_INDEX = "config/attachment_cache.json"  # 缓存索引文件
+    ATTACHMENT_CACHE_REVALIDATE_SECONDS = 24 * 3600  # 超过该时间后用 ETag/Last-Modified 向源站重新验证（秒）
+    ATTACHMENT_CACHE_MAX_FILE_BYTES = 20 * 1024 * 1024  # 单张图片大小上限（字节）
+    ATTACHMENT_CACHE_MAX_TOTAL_BYTES = 1024 * 1024 * 1024  # 缓存总大小上限（字节）
+    ATTACHMENT_CACHE_MAX_AGE_DAYS = 90  # 超过该天数未被使用的条目会被淘汰
+    ATTACHMENT_CACHE_FAILURE_BACKOFF_SECONDS = 300  # 下载失败后首次重试前的等待时间（秒），连续失败时加倍
+    ATTACHMENT_CACHE_MAX_FAILURE_BACKOFF_SECONDS = 24 * 3600  # 失败重试等待时间的上限（秒）
+    ATTACHMENT_CACHE_CLEANUP_INTERVAL_SECONDS = 3600  # 缓存清理间隔（秒）
+
     # Textin OCR 配置
     TEXTIN_API_URL = "https://api.textin.com/ai/service/v1/pdf_to_markdown"
     TEXTIN_API_ID = "your-textin-api-id"  # Textin API ID
@@ -23,6 +38,29 @@ class Config:
     AI_SYSTEM_PROMPT = "请对以下内容进行分析和解读，给出关键信息总结和见解："
     AUTO_AI_ANALYSIS = True  # 是否自动对文本进行AI解析
 
+    # 消息合并配置
+    COALESCE_QUIET_SECONDS = 3.0  # 同一会话静默多久后处理已收到的消息（秒），0 表示逐条处理
+    COALESCE_MAX_WAIT_SECONDS = 15.0  # 第一条消息最多等待多久（秒）
+    COALESCE_MAX_MESSAGES = 20  # 单批最多合并的消息数
+
+    # 调度配置
+    SCHEDULER_WORKERS = 4  # 同时处理的会话数
+    SCHEDULER_MAX_QUEUE_PER_CHAT = 20  # 单个会话最多排队的任务数
+    OCR_CONCURRENCY = 4  # OCR 服务的全局并发上限
+    OCR_CONCURRENCY_PER_CHAT = 2  # 单个会话可占用的 OCR 并发上限
+    AI_CONCURRENCY = 2  # AI 服务的全局并发上限
+
+    # 进度显示配置
+    PROGRESS_CARD = False  # 是否使用单张可更新的卡片显示处理进度（否则每个阶段发送一条文本消息）
+    PROGRESS_CARD_DEBOUNCE_SECONDS = 1.0  # 卡片更新的合并时间（秒）
+    PROGRESS_CARD_MAX_BYTES = 24 * 1024  # 整张卡片序列化后的最大字节数（飞书上限为 30KB），超出时截断结果，完整内容见笔记
+
     # 服务配置
     HOST = "0.0.0.0"
     PORT = 7000
+    RELOAD = False  # 开发模式：代码变更时自动重载（会额外启动监视进程，生产环境请关闭）
+    WARMUP_TIMEOUT_SECONDS = 15  # 启动预热的超时时间（秒）
+    WARMUP_RETRY_SECONDS = 5  # 获取 tenant_access_token 失败后首次重试的等待时间（秒），之后逐次加倍
+    WARMUP_MAX_RETRY_SECONDS = 60  # 重试等待时间的上限（秒）
+    SHUTDOWN_TIMEOUT_SECONDS = 20  # 关闭时等待已排队任务完成的最长时间（秒），超时后取消剩余任务，应小于编排系统的终止宽限期
+    HTTP_KEEPALIVE_SECONDS = 60  # 共享 HTTP 连接的空闲保持时间（秒）
@@ -0,0 +1,247 @@
+import os
+import re
+import json
+import hashlib
+import time
+import asyncio
+import logging
+from collections import Counter
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AttachmentCache:
+    """
+    远程图片的持久化索引：URL -> 附件文件名
+    记录 ETag/Last-Modified 用于重新验证，记录失败次数用于退避，
+    清理时统计笔记中的引用次数，仍被笔记引用的附件不会被删除
+    """
+
+    # 超过总大小上限时，两次清理之间的最小间隔（秒），避免被引用的附件无法删除时反复扫描笔记
+    MIN_CLEANUP_GAP_SECONDS = 60
+    # 被新内容替换的旧附件至少保留的时间（秒），避免删除正在生成的笔记刚取得的文件
+    ORPHAN_GRACE_SECONDS = 60
+
+    def __init__(self,
+                 index_path: str,
+                 vault_path: str,
+                 attachment_dir: str,
+                 attachment_link_dir: str,
+                 revalidate_seconds: float,
+                 max_total_bytes: int,
+                 max_age_seconds: float,
+                 failure_backoff_seconds: float,
+                 max_failure_backoff_seconds: float,
+                 cleanup_interval_seconds: float):
+        self.index_path = index_path
+        self.vault_path = vault_path
+        self.attachment_dir = attachment_dir
+        self.attachment_link_dir = attachment_link_dir
+        self.revalidate_seconds = revalidate_seconds
+        self.max_total_bytes = max_total_bytes
+        self.max_age_seconds = max_age_seconds
+        self.failure_backoff_seconds = failure_backoff_seconds
+        self.max_failure_backoff_seconds = max_failure_backoff_seconds
+        self.cleanup_interval_seconds = cleanup_interval_seconds
+        index = self._load()
+        self.entries: Dict[str, Dict[str, Any]] = index.get("entries", {})
+        self.failures: Dict[str, Dict[str, Any]] = index.get("failures", {})
+        # 已不对应任何 URL 的旧附件：文件名 -> 大小及替换时间，清理时在不再被引用后删除
+        self.orphans: Dict[str, Dict[str, Any]] = index.get("orphans", {})
+        self.last_cleanup_at: float = index.get("last_cleanup_at", 0.0)
+
+    def _load(self) -> Dict[str, Any]:
+        """加载索引文件"""
+        try:
+            if os.path.exists(self.index_path):
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            logger.error(f"加载附件缓存索引失败: {e}")
+        return {}
+
+    def save(self) -> bool:
+        """保存索引文件（先写临时文件再替换，避免写入中断损坏索引）"""
+        try:
+            directory = os.path.dirname(self.index_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "entries": self.entries,
+                    "failures": self.failures,
+                    "orphans": self.orphans,
+                    "last_cleanup_at": self.last_cleanup_at
+                }, f, ensure_ascii=False, indent=4)
+            os.replace(tmp_path, self.index_path)
+            return True
+        except Exception as e:
+            logger.error(f"保存附件缓存索引失败: {e}")
+            return False
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        """返回 URL 对应的缓存条目，附件文件已不存在时视为未命中"""
+        entry = self.entries.get(url)
+        if entry is None:
+            return None
+        if not os.path.exists(os.path.join(self.attachment_dir, entry["filename"])):
+            del self.entries[url]
+            return None
+        return entry
+
+    def needs_revalidation(self, entry: Dict[str, Any]) -> bool:
+        """距离上次验证超过期限时需要向源站重新验证"""
+        return time.time() - entry.get("validated_at", 0) > self.revalidate_seconds
+
+    def is_blocked(self, url: str) -> bool:
+        """URL 最近连续失败且仍在退避期内"""
+        failure = self.failures.get(url)
+        return failure is not None and time.time() < failure["retry_at"]
+
+    @staticmethod
+    def _digest(content: bytes) -> str:
+        return hashlib.sha256(content).hexdigest()
+
+    def same_content(self, entry: Dict[str, Any], content: bytes) -> bool:
+        """判断下载到的内容是否与已缓存的附件相同"""
+        if entry["size"] != len(content):
+            return False
+        digest = entry.get("sha256")
+        if digest is None:
+            # 旧版本索引没有记录摘要，读取已有文件计算
+            try:
+                with open(os.path.join(self.attachment_dir, entry["filename"]), 'rb') as f:
+                    digest = self._digest(f.read())
+            except OSError:
+                return False
+            entry["sha256"] = digest
+        return digest == self._digest(content)
+
+    def put(self, url: str, filename: str, content: bytes,
+            etag: Optional[str], last_modified: Optional[str]) -> None:
+        """记录新下载的附件，URL 原有的附件转为待清理的旧附件"""
+        now = time.time()
+        previous = self.entries.get(url)
+        if previous is not None and previous["filename"] != filename:
+            self.orphans[previous["filename"]] = {"size": previous["size"], "orphaned_at": now}
+        self.entries[url] = {
+            "filename": filename,
+            "size": len(content),
+            "sha256": self._digest(content),
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": now,
+            "validated_at": now,
+            "used_at": now
+        }
+        self.failures.pop(url, None)
+
+    def mark_valid(self, url: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        """源站确认内容未变化，返回了新的 ETag/Last-Modified 时一并更新"""
+        entry = self.entries[url]
+        entry["validated_at"] = time.time()
+        if etag:
+            entry["etag"] = etag
+        if last_modified:
+            entry["last_modified"] = last_modified
+        self.touch(url)
+
+    def touch(self, url: str) -> None:
+        """记录附件被再次使用"""
+        self.entries[url]["used_at"] = time.time()
+        self.failures.pop(url, None)
+
+    def record_failure(self, url: str, reason: str) -> None:
+        """记录下载失败，连续失败时退避时间成倍增长"""
+        failure = self.failures.get(url, {"count": 0})
+        count = failure["count"] + 1
+        backoff = min(
+            self.failure_backoff_seconds * (2 ** (count - 1)),
+            self.max_failure_backoff_seconds
+        )
+        self.failures[url] = {"count": count, "reason": reason, "retry_at": time.time() + backoff}
+
+    def _count_references(self) -> Counter:
+        """统计 vault 中所有笔记对附件的引用次数"""
+        pattern = re.compile(re.escape(self.attachment_link_dir) + r'/([^)\]\s|]+)')
+        references: Counter = Counter()
+        for root, _, files in os.walk(self.vault_path):
+            for name in files:
+                if not name.endswith(".md"):
+                    continue
+                try:
+                    with open(os.path.join(root, name), 'r', encoding='utf-8') as f:
+                        references.update(pattern.findall(f.read()))
+                except Exception as e:
+                    logger.warning(f"读取笔记失败 {name}: {e}")
+        return references
+
+    async def cleanup_if_due(self) -> None:
+        """超过总大小上限或到达清理间隔时执行清理"""
+        since_last = time.time() - self.last_cleanup_at
+        total = sum(entry["size"] for entry in self.entries.values())
+        total += sum(orphan["size"] for orphan in self.orphans.values())
+        over_limit = total > self.max_total_bytes and since_last >= self.MIN_CLEANUP_GAP_SECONDS
+        if over_limit or since_last >= self.cleanup_interval_seconds:
+            await self.cleanup()
+
+    async def cleanup(self) -> None:
+        """
+        淘汰过期条目，并按最近使用时间淘汰直到总大小低于上限；
+        只有未被任何笔记引用的附件（包括被新内容替换的旧附件）才会从磁盘删除
+        """
+        now = time.time()
+        self.last_cleanup_at = now
+        self.failures = {url: f for url, f in self.failures.items() if f["retry_at"] > now}
+
+        expired = {url for url, entry in self.entries.items()
+                   if now - entry.get("used_at", 0) > self.max_age_seconds}
+        total = sum(entry["size"] for url, entry in self.entries.items() if url not in expired)
+        total += sum(orphan["size"] for orphan in self.orphans.values())
+        for url, entry in sorted(self.entries.items(), key=lambda item: item[1].get("used_at", 0)):
+            if total <= self.max_total_bytes:
+                break
+            if url not in expired:
+                expired.add(url)
+                total -= entry["size"]
+
+        orphans = [name for name, orphan in self.orphans.items()
+                   if now - orphan["orphaned_at"] > self.ORPHAN_GRACE_SECONDS]
+        if not expired and not orphans:
+            self.save()
+            return
+
+        # 扫描笔记较慢，放到线程中执行
+        references = await asyncio.get_running_loop().run_in_executor(None, self._count_references)
+        removed = 0
+        for url in expired:
+            entry = self.entries.get(url)
+            # 扫描期间被再次使用，或仍被笔记引用（删除后只会导致重复下载），保留条目
+            if entry is None or entry.get("used_at", 0) > now or references[entry["filename"]] > 0:
+                continue
+            del self.entries[url]
+            if self._remove(entry["filename"]):
+                removed += 1
+        for name in orphans:
+            # 旧附件只能通过笔记中的链接访问，仍被引用时保留
+            if name not in self.orphans or references[name] > 0:
+                continue
+            del self.orphans[name]
+            if self._remove(name):
+                removed += 1
+
+        logger.info(f"附件缓存清理完成，删除未被引用的附件 {removed} 个")
+        self.save()
+
+    def _remove(self, filename: str) -> bool:
+        """删除附件文件，返回是否删除"""
+        try:
+            os.remove(os.path.join(self.attachment_dir, filename))
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.error(f"删除缓存附件失败 {filename}: {e}")
+            return False
@@ -0,0 +1,129 @@
+import asyncio
+import time
+import logging
+from collections import deque
+from typing import Dict, Any, List, Deque, Tuple, Callable, Awaitable, Optional
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[], Awaitable[Any]]
+
+
+class _ChatQueue:
+    """单个会话的待处理任务及统计"""
+
+    def __init__(self):
+        self.jobs: Deque[Tuple[Job, float]] = deque()
+        self.active = False  # 已在就绪队列中或正在执行
+        self.started = 0
+        self.processed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+
+class ChatScheduler:
+    """
+    按会话调度任务：
+    同一会话内的任务按提交顺序逐个执行，不同会话并行执行，
+    会话之间轮转取任务，避免单个会话占满全部处理能力
+    """
+
+    def __init__(self, workers: int, max_queue_per_chat: int):
+        self.workers = workers
+        self.max_queue_per_chat = max_queue_per_chat
+        # 只保留有待处理或正在执行任务的会话，队列清空后移除并将统计累加到 _totals
+        self._chats: Dict[str, _ChatQueue] = {}
+        self._totals = {"processed": 0, "rejected": 0, "started": 0, "total_wait": 0.0, "max_wait": 0.0}
+        self._ready: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+
+    def _start(self) -> None:
+        """首次提交任务时启动工作协程"""
+        if self._ready is not None:
+            return
+        self._ready = asyncio.Queue()
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, chat_id: str, job: Job) -> bool:
+        """提交任务，会话队列已满时返回 False"""
+        self._start()
+        chat = self._chats.setdefault(chat_id, _ChatQueue())
+        if len(chat.jobs) >= self.max_queue_per_chat:
+            chat.rejected += 1
+            self._totals["rejected"] += 1
+            logger.warning(f"会话 {chat_id} 的队列已满（{len(chat.jobs)}），拒绝新任务")
+            return False
+
+        chat.jobs.append((job, time.monotonic()))
+        if not chat.active:
+            chat.active = True
+            self._ready.put_nowait(chat_id)
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            chat_id = await self._ready.get()
+            chat = self._chats[chat_id]
+            job, enqueued_at = chat.jobs.popleft()
+            wait = time.monotonic() - enqueued_at
+            chat.started += 1
+            chat.total_wait += wait
+            chat.max_wait = max(chat.max_wait, wait)
+            self._totals["started"] += 1
+            self._totals["total_wait"] += wait
+            self._totals["max_wait"] = max(self._totals["max_wait"], wait)
+            try:
+                await job()
+            except Exception as e:
+                logger.error(f"会话 {chat_id} 的任务执行失败: {e}")
+            finally:
+                chat.processed += 1
+                self._totals["processed"] += 1
+                # 会话还有任务时排到就绪队列末尾，实现会话间轮转
+                if chat.jobs:
+                    self._ready.put_nowait(chat_id)
+                else:
+                    chat.active = False
+                    del self._chats[chat_id]
+                self._ready.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回当前活跃会话的队列深度和等待时间，以及全部任务的累计统计"""
+        chats = {}
+        for chat_id, chat in self._chats.items():
+            chats[chat_id] = {
+                "queue_depth": len(chat.jobs),
+                "oldest_wait": time.monotonic() - chat.jobs[0][1] if chat.jobs else 0.0,
+                "processed": chat.processed,
+                "rejected": chat.rejected,
+                "avg_wait": chat.total_wait / chat.started if chat.started else 0.0,
+                "max_wait": chat.max_wait
+            }
+        totals = self._totals
+        return {
+            "workers": self.workers,
+            "totals": {
+                "processed": totals["processed"],
+                "rejected": totals["rejected"],
+                "avg_wait": totals["total_wait"] / totals["started"] if totals["started"] else 0.0,
+                "max_wait": totals["max_wait"]
+            },
+            "chats": chats
+        }
+
+    async def close(self, timeout: Optional[float] = None) -> None:
+        """等待已提交的任务执行完毕后停止工作协程，超过 timeout 秒时取消剩余任务"""
+        if self._ready is None:
+            return
+        try:
+            await asyncio.wait_for(self._ready.join(), timeout)
+        except asyncio.TimeoutError:
+            pending = sum(len(chat.jobs) for chat in self._chats.values())
+            logger.warning(f"等待任务完成超时（{timeout}s），取消正在执行的任务并丢弃 {pending} 个待处理任务")
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._chats.clear()
+        self._ready = None
+        self._worker_tasks = []
@@ -1,11 +1,15 @@
 import json
 import aiohttp
+import asyncio
 import time
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Set, Tuple
 from config.config import Config
 from config.config_manager import ConfigManager
 from src.ocr_service import OCRService
 from src.obsidian_service import ObsidianService
+from src.message_batcher import MessageBatcher
+from src.chat_scheduler import ChatScheduler
+from src.progress_reporter import PlainTextProgress, ProgressCard
 import logging
 
 logger = logging.getLogger(__name__)
@@ -15,14 +19,111 @@ class FeishuBot:
         self.app_id = Config.FEISHU_APP_ID
         self.app_secret = Config.FEISHU_APP_SECRET
         self.verification_token = Config.FEISHU_VERIFICATION_TOKEN
-        self.ocr_service = OCRService()
-        self.obsidian_service = ObsidianService()
+        self._ocr_service: Optional[OCRService] = None
+        self._obsidian_service: Optional[ObsidianService] = None
+        self._session: Optional[aiohttp.ClientSession] = None
         self._tenant_access_token = None
+        self._tenant_access_token_expire_at = 0.0
+        self._token_lock = asyncio.Lock()
+
+        # 首条消息从 webhook 收到到首次回复（或写入笔记）的耗时
+        self.first_message_latency: Optional[float] = None
+        self._first_received_at: Optional[float] = None
+
+        # 同一会话内按顺序处理，不同会话之间轮转并行
+        self.scheduler = ChatScheduler(
+            workers=Config.SCHEDULER_WORKERS,
+            max_queue_per_chat=Config.SCHEDULER_MAX_QUEUE_PER_CHAT
+        )
+        # 限制对上游服务的全局并发
+        self.ocr_limiter = asyncio.Semaphore(Config.OCR_CONCURRENCY)
+        self.ai_limiter = asyncio.Semaphore(Config.AI_CONCURRENCY)
+        # 保留后台发送任务的引用，避免任务在执行前被回收
+        self._background_tasks: Set[asyncio.Task] = set()
+
+        # 按会话合并连续到达的消息，静默期为 0 时逐条处理
+        self.batcher: Optional[MessageBatcher] = None
+        if Config.COALESCE_QUIET_SECONDS > 0:
+            self.batcher = MessageBatcher(
+                self.schedule_messages,
+                quiet_period=Config.COALESCE_QUIET_SECONDS,
+                max_wait=Config.COALESCE_MAX_WAIT_SECONDS,
+                max_messages=Config.COALESCE_MAX_MESSAGES
+            )
         
         # 使用配置管理器
         self.config_manager = ConfigManager()
         self.load_runtime_config()
 
+    @property
+    def ocr_service(self) -> OCRService:
+        """首次使用时才创建 OCR 服务"""
+        if self._ocr_service is None:
+            self._ocr_service = OCRService()
+        return self._ocr_service
+
+    @property
+    def obsidian_service(self) -> ObsidianService:
+        """首次使用时才创建 Obsidian 服务（会创建 vault 目录）"""
+        if self._obsidian_service is None:
+            self._obsidian_service = ObsidianService()
+        return self._obsidian_service
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """获取共享的 HTTP 会话，复用连接以避免每次请求重新握手"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(keepalive_timeout=Config.HTTP_KEEPALIVE_SECONDS)
+            )
+        return self._session
+
+    async def close(self) -> None:
+        """处理完尚未合并完的消息，并关闭共享的 HTTP 会话"""
+        if self.batcher is not None:
+            self.batcher.close()
+        await self.scheduler.close(timeout=Config.SHUTDOWN_TIMEOUT_SECONDS)
+        if self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        if self._ocr_service is not None:
+            await self._ocr_service.close()
+
+    async def _warm_connection(self, url: str) -> None:
+        """预先建立到目标主机的连接（TLS 握手），忽略响应状态"""
+        async with self._get_session().head(url, allow_redirects=False) as response:
+            await response.release()
+
+    async def _warm_obsidian(self) -> None:
+        """
+        在线程中创建 vault 目录，服务对象仍在事件循环线程上构建，
+        避免与同时到达的消息各自构建出一个服务实例
+        """
+        await asyncio.get_running_loop().run_in_executor(None, ObsidianService.prepare_directories)
+        self.obsidian_service
+
+    async def warm_up(self) -> Dict[str, Optional[str]]:
+        """
+        并行预热：获取 tenant_access_token、构建服务并建立到 OCR 和 AI 服务的连接
+        返回各步骤的错误信息，成功的步骤为 None
+        """
+        steps = {
+            "tenant_access_token": self.get_tenant_access_token(),
+            "obsidian": self._warm_obsidian(),
+            "ocr": self.ocr_service.warm_up(),
+            "ai": self._warm_connection(self.ai_base_url),
+        }
+        results = await asyncio.gather(*steps.values(), return_exceptions=True)
+
+        errors: Dict[str, Optional[str]] = {}
+        for name, result in zip(steps, results):
+            if isinstance(result, BaseException):
+                logger.warning(f"预热 {name} 失败: {result}")
+                errors[name] = str(result) or type(result).__name__
+            else:
+                errors[name] = None
+        return errors
+
     def load_runtime_config(self):
         """从配置文件加载运行时配置"""
         self.auto_ai_analysis = self.config_manager.get("auto_ai_analysis", True)
@@ -30,6 +131,7 @@ class FeishuBot:
         self.ai_api_key = self.config_manager.get("ai_api_key", Config.AI_API_KEY)
         self.ai_model = self.config_manager.get("ai_model", Config.AI_MODEL)
         self.ai_system_prompt = self.config_manager.get("ai_system_prompt", Config.AI_SYSTEM_PROMPT)
+        self.progress_card = self.config_manager.get("progress_card", Config.PROGRESS_CARD)
 
     def save_runtime_config(self):
         """保存运行时配置到文件"""
@@ -38,13 +140,24 @@ class FeishuBot:
             "ai_base_url": self.ai_base_url,
             "ai_api_key": self.ai_api_key,
             "ai_model": self.ai_model,
-            "ai_system_prompt": self.ai_system_prompt
+            "ai_system_prompt": self.ai_system_prompt,
+            "progress_card": self.progress_card
         })
 
     async def get_tenant_access_token(self) -> str:
         """
-        获取飞书tenant_access_token
+        获取飞书tenant_access_token，在过期前复用缓存
         """
+        if self._tenant_access_token and time.time() < self._tenant_access_token_expire_at:
+            return self._tenant_access_token
+
+        async with self._token_lock:
+            if self._tenant_access_token and time.time() < self._tenant_access_token_expire_at:
+                return self._tenant_access_token
+            return await self._fetch_tenant_access_token()
+
+    async def _fetch_tenant_access_token(self) -> str:
+        """请求新的tenant_access_token"""
         url = "https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal"
         
         headers = {
@@ -55,18 +168,36 @@ class FeishuBot:
             "app_secret": self.app_secret
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=data) as response:
-                result = await response.json()
-                if result.get("code") == 0:
-                    self._tenant_access_token = result.get(
-                        "tenant_access_token")
-                    return self._tenant_access_token
-                raise Exception(f"获取tenant_access_token失败: {result}")
-
-    async def send_message(self, chat_id: str, msg_type: str, content: Dict[str, Any]) -> None:
+        async with self._get_session().post(url, headers=headers, json=data) as response:
+            result = await response.json()
+            if result.get("code") == 0:
+                self._tenant_access_token = result.get(
+                    "tenant_access_token")
+                # 提前刷新，避免使用即将过期的 token
+                self._tenant_access_token_expire_at = (
+                    time.time() + result.get("expire", 0) - Config.FEISHU_TOKEN_REFRESH_MARGIN
+                )
+                return self._tenant_access_token
+            raise Exception(f"获取tenant_access_token失败: {result}")
+
+    @staticmethod
+    def _encode_content(content: Dict[str, Any]) -> str:
+        """序列化消息内容（保留中文，避免转义后体积成倍增加）"""
+        return json.dumps(content, ensure_ascii=False)
+
+    @staticmethod
+    def _encode_body(data: Dict[str, Any]) -> bytes:
+        """序列化请求体"""
+        return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+    @classmethod
+    def content_size(cls, content: Dict[str, Any]) -> int:
+        """消息内容在请求体中实际占用的字节数，用于检查飞书的消息大小上限"""
+        return len(json.dumps(cls._encode_content(content), ensure_ascii=False).encode("utf-8"))
+
+    async def send_message(self, chat_id: str, msg_type: str, content: Dict[str, Any]) -> Optional[str]:
         """
-        发送消息到飞书群
+        发送消息到飞书群，返回消息ID
         """
         url = "https://open.feishu.cn/open-apis/im/v1/messages?receive_id_type=chat_id"
         headers = {
@@ -76,14 +207,33 @@ class FeishuBot:
         data = {
             "receive_id": chat_id,
             "msg_type": msg_type,
-            "content": json.dumps(content)
+            "content": self._encode_content(content)
+        }
+
+        async with self._get_session().post(url, headers=headers, data=self._encode_body(data)) as response:
+            result = await response.json()
+            if result.get("code") != 0:
+                raise Exception(f"发送消息失败: {result}")
+            return result.get("data", {}).get("message_id")
+
+    async def patch_message(self, message_id: str, content: Dict[str, Any]) -> None:
+        """
+        更新已发送的消息卡片
+        参考文档：https://open.feishu.cn/document/server-docs/im-v1/message-card/patch
+        """
+        url = f"https://open.feishu.cn/open-apis/im/v1/messages/{message_id}"
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {await self.get_tenant_access_token()}"
+        }
+        data = {
+            "content": self._encode_content(content)
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=data) as response:
-                result = await response.json()
-                if result.get("code") != 0:
-                    raise Exception(f"发送消息失败: {result}")
+        async with self._get_session().patch(url, headers=headers, data=self._encode_body(data)) as response:
+            result = await response.json()
+            if result.get("code") != 0:
+                raise Exception(f"更新消息失败: {result}")
 
     async def handle_command(self, chat_id: str, text: str) -> None:
         """处理命令消息"""
@@ -102,6 +252,8 @@ class FeishuBot:
 -oa: 图片OCR后进行AI解析
 -ta: 对所有文字进行AI解读
 -t: 不自动解析文字
+-c: 使用单张卡片显示处理进度
+-p: 使用多条文本消息显示处理进度
                 """
                 await self.send_message(chat_id, "text", {"text": help_text})
                 return True
@@ -142,6 +294,18 @@ class FeishuBot:
                 await self.send_message(chat_id, "text", {"text": "已关闭自动AI解析"})
                 return True
 
+            elif cmd == '-c':
+                self.progress_card = True
+                self.save_runtime_config()
+                await self.send_message(chat_id, "text", {"text": "已切换为卡片进度模式"})
+                return True
+
+            elif cmd == '-p':
+                self.progress_card = False
+                self.save_runtime_config()
+                await self.send_message(chat_id, "text", {"text": "已切换为文本进度模式"})
+                return True
+
             return False
 
         except Exception as e:
@@ -170,23 +334,27 @@ class FeishuBot:
                 ]
             }
 
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
+            async with self.ai_limiter:
+                async with self._get_session().post(
                     f"{self.ai_base_url}/chat/completions",
                     headers=headers,
                     json=data
                 ) as response:
                     result = await response.json()
-                    if "choices" in result and len(result["choices"]) > 0:
-                        return result["choices"][0]["message"]["content"]
-                    raise Exception(f"AI分析失败：{result}")
+            if "choices" in result and len(result["choices"]) > 0:
+                return result["choices"][0]["message"]["content"]
+            raise Exception(f"AI分析失败：{result}")
 
         except Exception as e:
             logger.error(f"AI分析失败: {e}")
             return None
 
-    async def handle_message(self, event: Dict[str, Any]) -> None:
-        """处理接收到的消息"""
+    async def handle_message(self, event: Dict[str, Any], received_at: Optional[float] = None) -> None:
+        """
+        处理接收到的消息
+        :param received_at: webhook 收到消息时的 time.perf_counter()，用于统计首条消息耗时
+        """
+        chat_id = None
         try:
             # 校验消息时间戳
             create_time = int(event.get("event", {}).get("message", {}).get("create_time", 0))
@@ -200,82 +368,184 @@ class FeishuBot:
             logger.info(f"处理消息: {message}")
             
             chat_id = message.get("chat_id")
-            message_id = message.get("message_id")
             msg_type = message.get("message_type")
 
-            text_content = None
-            image_links: List[str] = []
-            ocr_results: List[str] = []
-            ai_results: List[str] = []
-
+            # 命令不参与合并，但需排在此前已收到的消息之后执行
             if msg_type == "text":
                 content = json.loads(message.get("content", "{}"))
                 text = content.get("text", "").strip()
-                text_content = text
-                
-                # 处理命令
                 if text.startswith('-'):
-                    is_command = await self.handle_command(chat_id, text)
-                    if is_command:
-                        return
-
-                # 处理普通文本
-                if self.auto_ai_analysis and not text.startswith('-'):
-                    await self.send_message(chat_id, "text", {"text": "正在进行AI分析..."})
-                    ai_result = await self.analyze_with_ai(text)
-                    if ai_result:
-                        ai_results.append(ai_result)
-                        await self.send_message(chat_id, "text", {"text": f"AI分析结果：\n\n{ai_result}"})
-                    else:
-                        await self.send_message(chat_id, "text", {"text": "AI分析失败"})
+                    if self.batcher is not None:
+                        self.batcher.flush(chat_id)
+                    if not self.scheduler.submit(chat_id, lambda: self._run_command(chat_id, message, text)):
+                        await self._notify_queue_full(chat_id)
+                    return
 
-            # 处理图片消息
-            elif msg_type == "image":
-                if not message_id:
-                    raise Exception("未找到消息ID")
+            if self._first_received_at is None and received_at is not None:
+                self._first_received_at = received_at
+
+            if self.batcher is None:
+                self.schedule_messages(chat_id, [message])
+            else:
+                self.batcher.add(chat_id, message)
+
+        except Exception as e:
+            logger.error(f"处理消息失败: {e}")
+            if chat_id:
+                await self.send_message(chat_id, "text", {"text": f"处理失败：{str(e)}"})
 
-                # 获取图片内容
-                logger.info(f"获取图片内容，message_id: {message_id}")
-                image_content = await self.get_image_content(message_id)
+    def schedule_messages(self, chat_id: str, messages: List[Dict[str, Any]]) -> None:
+        """将一批消息加入会话的处理队列"""
+        if not self.scheduler.submit(chat_id, lambda: self.process_messages(chat_id, messages)):
+            task = asyncio.create_task(self._notify_queue_full(chat_id))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+
+    async def _notify_queue_full(self, chat_id: str) -> None:
+        try:
+            await self.send_message(chat_id, "text", {"text": "待处理的消息过多，请稍后再发送"})
+        except Exception as e:
+            logger.error(f"发送队列已满提示失败: {e}")
+
+    async def _run_command(self, chat_id: str, message: Dict[str, Any], text: str) -> None:
+        """执行命令，不是命令时按普通文本处理"""
+        is_command = await self.handle_command(chat_id, text)
+        if not is_command:
+            await self.process_messages(chat_id, [message])
+
+    def _record_first_response(self) -> None:
+        """首条消息第一次得到回复或写入笔记时记录耗时"""
+        if self.first_message_latency is not None or self._first_received_at is None:
+            return
+        self.first_message_latency = time.perf_counter() - self._first_received_at
+        logger.info(f"首条消息处理耗时 {self.first_message_latency:.3f} 秒")
+
+    def _create_progress(self, chat_id: str):
+        """按当前模式创建进度汇报对象"""
+        if self.progress_card:
+            return ProgressCard(
+                self,
+                chat_id,
+                title="飞书同步笔记",
+                debounce=Config.PROGRESS_CARD_DEBOUNCE_SECONDS,
+                max_bytes=Config.PROGRESS_CARD_MAX_BYTES
+            )
+        return PlainTextProgress(self, chat_id)
+
+    async def _process_image(self, message_id: str, chat_limiter: asyncio.Semaphore) -> Tuple[Optional[str], str]:
+        """获取图片、保存到 Obsidian 并进行 OCR，返回图片链接和 OCR 结果"""
+        logger.info(f"获取图片内容，message_id: {message_id}")
+        image_content = await self.get_image_content(message_id)
+
+        # 保存图片到 Obsidian
+        image_link = await self.obsidian_service.save_image(image_content)
+
+        # 进行OCR处理，同时受会话内和全局并发限制
+        async with chat_limiter, self.ocr_limiter:
+            ocr_result = await self.ocr_service.process_image(image_content)
+        return image_link, ocr_result
+
+    async def process_messages(self, chat_id: str, messages: List[Dict[str, Any]]) -> None:
+        """
+        处理同一会话中合并后的一批消息：
+        并行识别所有图片，对合并后的文本只进行一次AI分析，并生成一篇笔记
+        """
+        progress = self._create_progress(chat_id)
+        try:
+            texts: List[str] = []
+            image_message_ids: List[str] = []
+            image_links: List[str] = []
+            ocr_results: List[str] = []
+            ocr_indexes: List[int] = []  # 每条 OCR 结果对应的图片序号，部分图片失败时保持原序号
+            ai_results: List[str] = []
 
-                # 保存图片到 Obsidian
-                image_link = await self.obsidian_service.save_image(image_content)
-                if image_link:
-                    image_links.append(image_link)
+            for message in messages:
+                msg_type = message.get("message_type")
+                if msg_type == "text":
+                    content = json.loads(message.get("content", "{}"))
+                    text = content.get("text", "").strip()
+                    if text:
+                        texts.append(text)
+                elif msg_type == "image":
+                    message_id = message.get("message_id")
+                    if not message_id:
+                        raise Exception("未找到消息ID")
+                    image_message_ids.append(message_id)
 
+            # 处理图片消息
+            if image_message_ids:
                 # 发送处理中的提示
-                await self.send_message(chat_id, "text", {"text": "正在处理图片，请稍候..."})
-
-                # 进行OCR处理
-                ocr_result = await self.ocr_service.process_image(image_content)
-                ocr_results.append(ocr_result)
-                await self.send_message(chat_id, "text", {"text": f"OCR识别结果：\n\n{ocr_result}"})
-
-                # 如果开启了自动AI分析，进行AI解析
-                if self.auto_ai_analysis:
-                    await self.send_message(chat_id, "text", {"text": "正在进行AI分析..."})
-                    ai_result = await self.analyze_with_ai(ocr_result)
-                    if ai_result:
-                        ai_results.append(ai_result)
-                        await self.send_message(chat_id, "text", {"text": f"AI分析结果：\n\n{ai_result}"})
+                if len(image_message_ids) > 1:
+                    notice = f"正在处理 {len(image_message_ids)} 张图片，请稍候..."
+                else:
+                    notice = "正在处理图片，请稍候..."
+                await progress.status(notice)
+                self._record_first_response()
+
+                # 单个会话最多占用部分 OCR 并发，避免挤占其他会话
+                chat_limiter = asyncio.Semaphore(Config.OCR_CONCURRENCY_PER_CHAT)
+                results = await asyncio.gather(
+                    *(self._process_image(message_id, chat_limiter) for message_id in image_message_ids),
+                    return_exceptions=True
+                )
+                failures = []
+                for idx, result in enumerate(results, 1):
+                    if isinstance(result, Exception):
+                        logger.error(f"处理第 {idx} 张图片失败: {result}")
+                        failures.append(f"图片 {idx}：{str(result)}")
+                        continue
+                    image_link, ocr_result = result
+                    if image_link:
+                        image_links.append(image_link)
+                    ocr_results.append(ocr_result)
+                    ocr_indexes.append(idx)
+
+                if ocr_results:
+                    if len(image_message_ids) > 1:
+                        ocr_text = "\n\n".join(
+                            f"【图片 {idx}】\n{result}" for idx, result in zip(ocr_indexes, ocr_results)
+                        )
                     else:
-                        await self.send_message(chat_id, "text", {"text": "AI分析失败"})
+                        ocr_text = ocr_results[0]
+                    await progress.section("OCR识别结果", ocr_text)
+                if failures:
+                    await progress.note("处理失败：\n" + "\n".join(failures))
+
+            # 如果开启了自动AI分析，对合并后的文本进行一次AI解析
+            analysis_text = "\n\n".join(
+                [text for text in texts if not text.startswith('-')] + ocr_results
+            )
+            if self.auto_ai_analysis and analysis_text:
+                await progress.status("正在进行AI分析...")
+                self._record_first_response()
+                ai_result = await self.analyze_with_ai(analysis_text)
+                if ai_result:
+                    ai_results.append(ai_result)
+                    await progress.section("AI分析结果", ai_result)
+                else:
+                    await progress.note("AI分析失败")
+
+            if not texts and not ocr_results:
+                return
 
             # 创建 Obsidian 笔记
             note_path = await self.obsidian_service.create_note(
-                text=text_content,
+                text="\n\n".join(texts) if texts else None,
                 image_links=image_links if image_links else None,
                 ocr_results=ocr_results if ocr_results else None,
+                ocr_indexes=ocr_indexes if len(image_message_ids) > 1 else None,
                 ai_results=ai_results if ai_results else None
             )
+            self._record_first_response()
 
             if note_path:
-                await self.send_message(chat_id, "text", {"text": f"已保存到 Obsidian: {note_path}"})
+                await progress.note(f"已保存到 Obsidian: {note_path}")
 
         except Exception as e:
             logger.error(f"处理消息失败: {e}")
-            if chat_id:
-                await self.send_message(chat_id, "text", {"text": f"处理失败：{str(e)}"})
+            await progress.note(f"处理失败：{str(e)}")
+        finally:
+            await progress.finish()
 
     async def get_image_content(self, message_id: str) -> str:
         """
@@ -292,28 +562,28 @@ class FeishuBot:
             "Content-Type": "application/json"
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                result = await response.json()
-                logger.info(f"获取消息响应: {result}")
-                
-                if result.get("code") != 0:
-                    logger.error(f"获取消息失败: {result}")
-                    raise Exception(f"获取消息失败: {result}")
-                
-                message_content = result.get("data", {}).get("items", [{}])[0]
-                content = json.loads(message_content.get("body", {}).get("content", "{}"))
-                file_key = content.get("image_key")
-                
-                if not file_key:
-                    logger.error("消息中未找到file_key")
-                    raise Exception("消息中未找到file_key")
-                
-                # 2. 获取图片资源
-                image_url = f"https://open.feishu.cn/open-apis/im/v1/messages/{message_id}/resources/{file_key}?type=image"
-                async with session.get(image_url, headers=headers) as img_response:
-                    if img_response.status != 200:
-                        result = await img_response.json()
-                        logger.error(f"获取图片资源失败: {result}")
-                        raise Exception(f"获取图片资源失败: {result}")
-                    return await img_response.content.read()
+        session = self._get_session()
+        async with session.get(url, headers=headers) as response:
+            result = await response.json()
+            logger.info(f"获取消息响应: {result}")
+            
+            if result.get("code") != 0:
+                logger.error(f"获取消息失败: {result}")
+                raise Exception(f"获取消息失败: {result}")
+            
+            message_content = result.get("data", {}).get("items", [{}])[0]
+            content = json.loads(message_content.get("body", {}).get("content", "{}"))
+            file_key = content.get("image_key")
+            
+            if not file_key:
+                logger.error("消息中未找到file_key")
+                raise Exception("消息中未找到file_key")
+            
+            # 2. 获取图片资源
+            image_url = f"https://open.feishu.cn/open-apis/im/v1/messages/{message_id}/resources/{file_key}?type=image"
+            async with session.get(image_url, headers=headers) as img_response:
+                if img_response.status != 200:
+                    result = await img_response.json()
+                    logger.error(f"获取图片资源失败: {result}")
+                    raise Exception(f"获取图片资源失败: {result}")
+                return await img_response.content.read()
@@ -1,8 +1,14 @@
 from src.feishu_bot import FeishuBot
+from src.webhook_guard import WebhookGuard, WebhookRejected
 from config.config import Config
 from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+import asyncio
 import sys
 import os
+import time
 import logging
 import traceback
 
@@ -16,23 +22,108 @@ logger = logging.getLogger(__name__)
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-app = FastAPI()
-bot = FeishuBot()
+class StartupState:
+    """记录启动预热进度和就绪耗时"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.ready = False
+        self.time_to_ready: Optional[float] = None
+        self.warmup_errors: Dict[str, Optional[str]] = {}
+
+    def to_dict(self) -> Dict:
+        return {
+            "ready": self.ready,
+            "time_to_ready": self.time_to_ready,
+            "warmup_errors": self.warmup_errors
+        }
+
+startup = StartupState()
+bot: Optional[FeishuBot] = None
+guard = WebhookGuard()
+
+async def warm_up() -> None:
+    """
+    后台预热服务，完成后标记为就绪
+    OCR/AI 连接预热失败不影响就绪；tenant_access_token 是处理消息的前提，获取成功前保持未就绪并持续重试
+    """
+    try:
+        startup.warmup_errors = await asyncio.wait_for(bot.warm_up(), Config.WARMUP_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        logger.warning(f"预热超过 {Config.WARMUP_TIMEOUT_SECONDS} 秒，跳过剩余步骤")
+        startup.warmup_errors = {"timeout": f"预热超过 {Config.WARMUP_TIMEOUT_SECONDS} 秒"}
+
+    delay = Config.WARMUP_RETRY_SECONDS
+    while True:
+        try:
+            # token 已在预热中获取成功时直接命中缓存
+            await asyncio.wait_for(bot.get_tenant_access_token(), Config.WARMUP_TIMEOUT_SECONDS)
+            startup.warmup_errors["tenant_access_token"] = None
+            break
+        except Exception as e:
+            startup.warmup_errors["tenant_access_token"] = str(e) or type(e).__name__
+            logger.warning(f"获取 tenant_access_token 失败，{delay} 秒后重试: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, Config.WARMUP_MAX_RETRY_SECONDS)
+
+    startup.time_to_ready = time.perf_counter() - startup.started_at
+    startup.ready = True
+    logger.info(f"服务就绪，耗时 {startup.time_to_ready:.3f} 秒")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    启动时构建机器人并在后台预热，关闭时释放连接
+    """
+    global bot
+    bot = FeishuBot()
+    warmup_task = asyncio.create_task(warm_up())
+    try:
+        yield
+    finally:
+        warmup_task.cancel()
+        # 预热任务可能仍在使用共享会话，等它退出后再关闭
+        await asyncio.gather(warmup_task, return_exceptions=True)
+        await bot.close()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.get("/healthz")
+async def healthz():
+    """
+    存活探针：进程能响应即返回成功
+    """
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """
+    就绪探针：预热完成且已获取 tenant_access_token 后才返回成功
+    """
+    content = startup.to_dict()
+    content["first_message_latency"] = bot.first_message_latency if bot is not None else None
+    return JSONResponse(status_code=200 if startup.ready else 503, content=content)
 
 @app.post("/webhook/feishu")
 async def feishu_webhook(request: Request):
     """
     处理飞书事件回调
     """
+    received_at = time.perf_counter()
+    event = None
     try:
-        # 获取请求头中的验证信息
-        timestamp = request.headers.get("X-Lark-Request-Timestamp", "")
-        nonce = request.headers.get("X-Lark-Request-Nonce", "")
-        signature = request.headers.get("X-Lark-Signature", "")
+        # 准入检查：在解析和记录日志之前拒绝超大、伪造、过期或重放的请求
+        try:
+            body = await guard.read_body(request)
+            event = guard.admit(request.headers, body)
+        except WebhookRejected as rejected:
+            return JSONResponse(
+                status_code=rejected.status_code,
+                content={"code": rejected.status_code, "msg": rejected.reason}
+            )
 
-        # 获取请求体
-        event = await request.json()
-        logger.info(f"Received event: {event}")
+        header = event.get("header") or {}
+        logger.info(f"Received event: {header.get('event_type') or event.get('type')}, event_id: {header.get('event_id')}")
 
         # 处理飞书服务器的验证请求
         if event.get("type") == "url_verification":
@@ -40,20 +131,8 @@ async def feishu_webhook(request: Request):
             logger.info("Handling URL verification request")
             return {"challenge": challenge}
 
-        # # 验证请求是否来自飞书
-        # print(event.get("token"))
-        # if event.get("token") != Config.FEISHU_VERIFICATION_TOKEN:
-        #     logger.error("Invalid verification token")
-        #     raise HTTPException(
-        #         status_code=401, 
-        #         detail={
-        #             "error": "Invalid verification token",
-        #             "error_description": "The provided verification token does not match"
-        #         }
-        #     )
-
         # 处理消息事件
-        if event.get("header").get("event_type") == "im.message.receive_v1":
+        if header.get("event_type") == "im.message.receive_v1":
             logger.info("Processing message event")
             event_data = event.get("event")
             if not event_data:
@@ -65,16 +144,21 @@ async def feishu_webhook(request: Request):
 
             # 处理所有消息
             logger.info("Processing message")
-            await bot.handle_message(event)
-            
+            await bot.handle_message(event, received_at)
+
             return {"code": 0, "msg": "success"}
 
         return {"code": 0, "msg": "success"}
 
     except HTTPException as he:
         logger.error(f"HTTP Exception: {str(he)}")
+        if event is not None:
+            guard.forget(event)
         raise he
     except Exception as e:
+        # 处理失败时允许飞书重试投递同一事件
+        if event is not None:
+            guard.forget(event)
         error_detail = {
             "error": str(e),
             "error_trace": traceback.format_exc(),
@@ -86,11 +170,27 @@ async def feishu_webhook(request: Request):
             detail=error_detail
         )
 
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    """
+    各会话的队列深度和等待时间
+    """
+    if bot is None:
+        return {"workers": 0, "chats": {}}
+    return bot.scheduler.stats()
+
+@app.get("/webhook/feishu/stats")
+async def feishu_webhook_stats():
+    """
+    飞书回调的准入计数（按拒绝原因统计）
+    """
+    return guard.stats()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
         "src.main:app",
         host=Config.HOST,
         port=Config.PORT,
-        reload=True
+        reload=Config.RELOAD
     )
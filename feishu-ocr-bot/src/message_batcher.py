@@ -0,0 +1,73 @@
+import asyncio
+import time
+import logging
+from typing import Dict, Any, List, Callable
+
+logger = logging.getLogger(__name__)
+
+BatchHandler = Callable[[str, List[Dict[str, Any]]], None]
+
+
+class MessageBatcher:
+    """
+    按会话合并短时间内连续到达的消息：
+    同一会话在静默期内持续收到消息时不断推迟处理，静默期结束、
+    等待时间达到上限或消息数达到上限时，将整批消息交给处理函数
+    """
+
+    def __init__(self, handler: BatchHandler, quiet_period: float, max_wait: float, max_messages: int):
+        self.handler = handler
+        self.quiet_period = quiet_period
+        self.max_wait = max_wait
+        self.max_messages = max_messages
+        self._pending: Dict[str, List[Dict[str, Any]]] = {}
+        self._first_at: Dict[str, float] = {}
+        self._timers: Dict[str, asyncio.Task] = {}
+
+    def add(self, chat_id: str, message: Dict[str, Any]) -> None:
+        """加入一条消息，并重新计算该会话的处理时间"""
+        now = time.monotonic()
+        pending = self._pending.setdefault(chat_id, [])
+        pending.append(message)
+        self._first_at.setdefault(chat_id, now)
+
+        timer = self._timers.pop(chat_id, None)
+        if timer is not None:
+            timer.cancel()
+
+        if len(pending) >= self.max_messages:
+            self._flush(chat_id)
+            return
+
+        delay = min(self.quiet_period, self.max_wait - (now - self._first_at[chat_id]))
+        self._timers[chat_id] = asyncio.create_task(self._flush_later(chat_id, max(delay, 0)))
+
+    async def _flush_later(self, chat_id: str, delay: float) -> None:
+        await asyncio.sleep(delay)
+        self._timers.pop(chat_id, None)
+        self._flush(chat_id)
+
+    def flush(self, chat_id: str) -> None:
+        """立即处理会话中已累积的消息"""
+        timer = self._timers.pop(chat_id, None)
+        if timer is not None:
+            timer.cancel()
+        self._flush(chat_id)
+
+    def _flush(self, chat_id: str) -> None:
+        """将会话中已累积的消息交给处理函数"""
+        messages = self._pending.pop(chat_id, None)
+        self._first_at.pop(chat_id, None)
+        if not messages:
+            return
+
+        logger.info(f"合并会话 {chat_id} 的 {len(messages)} 条消息")
+        try:
+            self.handler(chat_id, messages)
+        except Exception as e:
+            logger.error(f"处理会话 {chat_id} 的合并消息失败: {e}")
+
+    def close(self) -> None:
+        """立即处理所有未到期的消息"""
+        for chat_id in list(self._pending):
+            self.flush(chat_id)
@@ -5,9 +5,10 @@ import aiohttp
 import re
 import asyncio
 from pathlib import Path
-from typing import Optional, List, TypeVar, Callable, Any
+from typing import Optional, List, Dict, Tuple, TypeVar, Callable, Any
 from functools import wraps
 from config.config import Config
+from src.attachment_cache import AttachmentCache
 
 logger = logging.getLogger(__name__)
 
@@ -57,14 +58,41 @@ class ObsidianService:
         self.enabled = Config.OBSIDIAN_ENABLED
         self._ensure_directories()
 
+        # 远程图片缓存：同一 URL 只下载一次，之后的笔记直接引用已有附件
+        self.attachment_cache: Optional[AttachmentCache] = None
+        if self.enabled and Config.ATTACHMENT_CACHE_ENABLED:
+            self.attachment_cache = AttachmentCache(
+                index_path=Config.ATTACHMENT_CACHE_INDEX,
+                vault_path=self.vault_path,
+                attachment_dir=self.attachment_dir,
+                attachment_link_dir=Config.OBSIDIAN_ATTACHMENT_DIR,
+                revalidate_seconds=Config.ATTACHMENT_CACHE_REVALIDATE_SECONDS,
+                max_total_bytes=Config.ATTACHMENT_CACHE_MAX_TOTAL_BYTES,
+                max_age_seconds=Config.ATTACHMENT_CACHE_MAX_AGE_DAYS * 86400,
+                failure_backoff_seconds=Config.ATTACHMENT_CACHE_FAILURE_BACKOFF_SECONDS,
+                max_failure_backoff_seconds=Config.ATTACHMENT_CACHE_MAX_FAILURE_BACKOFF_SECONDS,
+                cleanup_interval_seconds=Config.ATTACHMENT_CACHE_CLEANUP_INTERVAL_SECONDS
+            )
+        self._inflight_downloads: Dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def prepare_directories() -> None:
+        """
+        创建 vault 中的附件和同步目录
+        不依赖服务实例，可在线程中预先执行
+        """
+        if not Config.OBSIDIAN_ENABLED:
+            return
+        Path(os.path.join(Config.OBSIDIAN_VAULT_PATH, Config.OBSIDIAN_ATTACHMENT_DIR)).mkdir(parents=True, exist_ok=True)
+        Path(os.path.join(Config.OBSIDIAN_VAULT_PATH, Config.OBSIDIAN_SYNC_DIR)).mkdir(parents=True, exist_ok=True)
+
     def _ensure_directories(self):
         """确保必要的目录存在"""
         if not self.enabled:
             return
         
         try:
-            Path(self.attachment_dir).mkdir(parents=True, exist_ok=True)
-            Path(self.sync_dir).mkdir(parents=True, exist_ok=True)
+            self.prepare_directories()
         except Exception as e:
             logger.error(f"创建 Obsidian 目录失败: {e}")
             self.enabled = False
@@ -73,6 +101,15 @@ class ObsidianService:
         """获取当前时间戳字符串"""
         return datetime.datetime.now().strftime("%Y%m%d%H%M%S")
 
+    def _get_unique_filename(self, directory: str, stem: str, suffix: str) -> str:
+        """生成目录内不重复的文件名，同一秒内的多个文件依次追加序号"""
+        filename = f"{stem}{suffix}"
+        index = 1
+        while os.path.exists(os.path.join(directory, filename)):
+            filename = f"{stem}-{index}{suffix}"
+            index += 1
+        return filename
+
     async def save_image(self, image_content: bytes) -> Optional[str]:
         """
         保存图片到 attachment 目录
@@ -83,7 +120,7 @@ class ObsidianService:
 
         try:
             timestamp = self._get_timestamp()
-            image_filename = f"{timestamp}.png"
+            image_filename = self._get_unique_filename(self.attachment_dir, timestamp, ".png")
             image_path = os.path.join(self.attachment_dir, image_filename)
             
             with open(image_path, "wb") as f:
@@ -98,16 +135,18 @@ class ObsidianService:
                          text: Optional[str] = None, 
                          image_links: Optional[List[str]] = None,
                          ocr_results: Optional[List[str]] = None,
-                         ai_results: Optional[List[str]] = None) -> Optional[str]:
+                         ai_results: Optional[List[str]] = None,
+                         ocr_indexes: Optional[List[int]] = None) -> Optional[str]:
         """
         创建新的笔记文件
+        ocr_indexes 为每条 OCR 结果对应的图片序号，未提供时按顺序编号
         """
         if not self.enabled:
             return None
 
         try:
             timestamp = self._get_timestamp()
-            note_filename = f"{timestamp}.md"
+            note_filename = self._get_unique_filename(self.sync_dir, timestamp, ".md")
             note_path = os.path.join(self.sync_dir, note_filename)
 
             content_parts = []
@@ -130,8 +169,9 @@ class ObsidianService:
             # 添加 OCR 结果
             if ocr_results and len(ocr_results) > 0:
                 content_parts.append("## OCR 识别结果")
-                for idx, result in enumerate(ocr_results, 1):
-                    if len(ocr_results) > 1:
+                indexes = ocr_indexes or range(1, len(ocr_results) + 1)
+                for idx, result in zip(indexes, ocr_results):
+                    if ocr_indexes or len(ocr_results) > 1:
                         content_parts.append(f"### 图片 {idx} OCR 结果")
                     # 处理 OCR 结果中的远程图片
                     processed_result = await self.process_remote_images_in_markdown(result)
@@ -150,6 +190,10 @@ class ObsidianService:
             with open(note_path, "w", encoding="utf-8") as f:
                 f.write(content)
 
+            # 笔记写入后再清理缓存，保证刚引用的附件会被计入引用
+            if self.attachment_cache is not None:
+                await self.attachment_cache.cleanup_if_due()
+
             return note_path
         except Exception as e:
             logger.error(f"创建笔记失败: {e}")
@@ -167,41 +211,20 @@ class ObsidianService:
         image_pattern = r'!\[([^\]]*)\]\((https?://[^)]+)\)'
         logger.info(f"开始处理 markdown 文本中的远程图片，文本长度: {len(markdown_text)}")
         
-        @async_retry(retries=3, delay=1.0, backoff=2.0, exceptions=(aiohttp.ClientError, asyncio.TimeoutError))
-        async def download_image(session: aiohttp.ClientSession, url: str) -> Optional[bytes]:
-            """下载图片的重试包装函数"""
-            async with session.get(url, timeout=30) as response:
-                if response.status == 200:
-                    return await response.read()
-                response.raise_for_status()
-            return None
-
-        async def download_and_replace(match) -> str:
+        async def download_and_replace(session: aiohttp.ClientSession, match) -> str:
             alt_text = match.group(1)
             image_url = match.group(2)
             logger.info(f"发现远程图片链接: {image_url}")
-            
+
             try:
-                async with aiohttp.ClientSession() as session:
-                    logger.info(f"开始下载图片: {image_url}")
-                    image_content = await download_image(session, image_url)
-                    
-                    if image_content:
-                        timestamp = self._get_timestamp()
-                        image_filename = f"{timestamp}.png"
-                        image_path = os.path.join(self.attachment_dir, image_filename)
-                        
-                        # 保存图片
-                        with open(image_path, "wb") as f:
-                            f.write(image_content)
-                        
-                        # 返回 Obsidian 格式的本地图片链接
-                        new_link = f"![{alt_text}]({Config.OBSIDIAN_ATTACHMENT_DIR}/{image_filename})"
-                        logger.info(f"图片下载成功，新链接: {new_link}")
-                        return new_link
-                    else:
-                        logger.error(f"下载图片失败: {image_url}")
-                        return match.group(0)
+                image_filename = await self._get_remote_image(session, image_url)
+                if image_filename:
+                    # 返回 Obsidian 格式的本地图片链接
+                    new_link = f"![{alt_text}]({Config.OBSIDIAN_ATTACHMENT_DIR}/{image_filename})"
+                    logger.info(f"图片已本地化，新链接: {new_link}")
+                    return new_link
+                logger.error(f"下载图片失败: {image_url}")
+                return match.group(0)
             except Exception as e:
                 logger.error(f"下载图片失败 {image_url}: {e}")
                 return match.group(0)  # 如果下载失败，保留原始链接
@@ -211,11 +234,114 @@ class ObsidianService:
         matches = list(re.finditer(image_pattern, markdown_text))
         logger.info(f"找到 {len(matches)} 个远程图片链接")
         
-        for match in matches:
-            original_link = match.group(0)
-            replacement = await download_and_replace(match)
-            result = result.replace(original_link, replacement)
-            logger.info(f"替换链接: {original_link} -> {replacement}")
+        async with aiohttp.ClientSession() as session:
+            for match in matches:
+                original_link = match.group(0)
+                replacement = await download_and_replace(session, match)
+                result = result.replace(original_link, replacement)
+                logger.info(f"替换链接: {original_link} -> {replacement}")
+
+        if self.attachment_cache is not None and matches:
+            self.attachment_cache.save()
 
         logger.info("远程图片处理完成")
-        return result 
\ No newline at end of file
+        return result
+
+    @async_retry(retries=3, delay=1.0, backoff=2.0, exceptions=(aiohttp.ClientError, asyncio.TimeoutError))
+    async def _fetch_remote_image(self, session: aiohttp.ClientSession, url: str,
+                                  headers: Dict[str, str]) -> Tuple[int, Optional[bytes], Optional[str], Optional[str]]:
+        """
+        下载图片的重试包装函数
+        返回状态码、图片内容、ETag 和 Last-Modified；未修改时状态码为 304，内容为 None
+        """
+        async with session.get(url, headers=headers, timeout=30) as response:
+            if response.status == 304:
+                return 304, None, None, None
+            # 除超时和限流外的 4xx 不会因重试而改变，直接失败以便立即记入失败缓存
+            if 400 <= response.status < 500 and response.status not in (408, 429):
+                raise Exception(f"图片请求失败: {response.status}")
+            if response.status != 200:
+                response.raise_for_status()
+
+            max_bytes = Config.ATTACHMENT_CACHE_MAX_FILE_BYTES
+            if response.content_length and response.content_length > max_bytes:
+                raise ValueError(f"图片大小 {response.content_length} 超过上限 {max_bytes}")
+            chunks = []
+            size = 0
+            async for chunk in response.content.iter_chunked(64 * 1024):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ValueError(f"图片大小超过上限 {max_bytes}")
+                chunks.append(chunk)
+            return 200, b"".join(chunks), response.headers.get("ETag"), response.headers.get("Last-Modified")
+
+    def _save_attachment(self, content: bytes) -> str:
+        """保存附件，返回文件名"""
+        timestamp = self._get_timestamp()
+        image_filename = self._get_unique_filename(self.attachment_dir, timestamp, ".png")
+        with open(os.path.join(self.attachment_dir, image_filename), "wb") as f:
+            f.write(content)
+        return image_filename
+
+    async def _get_remote_image(self, session: aiohttp.ClientSession, url: str) -> Optional[str]:
+        """获取远程图片对应的附件文件名，同一 URL 的并发请求只下载一次"""
+        future = self._inflight_downloads.get(url)
+        if future is None:
+            future = asyncio.ensure_future(self._localize_remote_image(session, url))
+            self._inflight_downloads[url] = future
+            future.add_done_callback(lambda _: self._inflight_downloads.pop(url, None))
+        return await asyncio.shield(future)
+
+    async def _localize_remote_image(self, session: aiohttp.ClientSession, url: str) -> Optional[str]:
+        """
+        将远程图片保存为本地附件，返回文件名
+        缓存命中时直接复用已有附件，过期时用 ETag/Last-Modified 向源站重新验证
+        """
+        cache = self.attachment_cache
+        if cache is None:
+            logger.info(f"开始下载图片: {url}")
+            _, content, _, _ = await self._fetch_remote_image(session, url, {})
+            return self._save_attachment(content)
+
+        entry = cache.get(url)
+        if entry is not None and not cache.needs_revalidation(entry):
+            logger.info(f"命中附件缓存: {url} -> {entry['filename']}")
+            cache.touch(url)
+            return entry["filename"]
+        if entry is None and cache.is_blocked(url):
+            logger.info(f"图片近期多次下载失败，暂不重试: {url}")
+            return None
+
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        try:
+            logger.info(f"开始下载图片: {url}")
+            status, content, etag, last_modified = await self._fetch_remote_image(session, url, headers)
+        except Exception as e:
+            if entry is not None:
+                # 重新验证失败时继续使用已有附件
+                logger.warning(f"重新验证图片失败，继续使用缓存 {url}: {e}")
+                cache.touch(url)
+                return entry["filename"]
+            cache.record_failure(url, str(e))
+            raise
+
+        if status == 304 and entry is not None:
+            logger.info(f"图片未修改，复用附件缓存: {url} -> {entry['filename']}")
+            cache.mark_valid(url)
+            return entry["filename"]
+
+        if entry is not None and cache.same_content(entry, content):
+            # 源站忽略了条件请求但内容未变，复用已有附件
+            logger.info(f"图片内容未变化，复用附件缓存: {url} -> {entry['filename']}")
+            cache.mark_valid(url, etag, last_modified)
+            return entry["filename"]
+
+        image_filename = self._save_attachment(content)
+        cache.put(url, image_filename, content, etag, last_modified)
+        return image_filename 
\ No newline at end of file
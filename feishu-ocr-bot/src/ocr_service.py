@@ -1,5 +1,6 @@
 import aiohttp
 import base64
+from typing import Optional
 from config.config import Config
 
 
@@ -8,6 +9,25 @@ class OCRService:
         self.api_url = Config.TEXTIN_API_URL
         self.api_id = Config.TEXTIN_API_ID
         self.api_secret = Config.TEXTIN_API_SECRET
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """获取共享的 HTTP 会话，复用到 OCR 服务的连接"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(keepalive_timeout=Config.HTTP_KEEPALIVE_SECONDS)
+            )
+        return self._session
+
+    async def close(self) -> None:
+        """关闭共享的 HTTP 会话"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def warm_up(self) -> None:
+        """预先建立到 OCR 服务的连接（TLS 握手），忽略响应状态"""
+        async with self._get_session().head(self.api_url, allow_redirects=False) as response:
+            await response.release()
 
     async def process_image(self, image_data: bytes) -> str:
         """
@@ -22,20 +42,19 @@ class OCRService:
         }
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    self.api_url,
-                    headers=headers,
-                    data=image_data
-                ) as response:
-                    if response.status != 200:
-                        raise Exception(f"OCR API请求失败: {response.status}")
-
-                    result = await response.json()
-                    if result.get('code') != 200:
-                        raise Exception(f"OCR处理失败: {result.get('message')}")
-
-                    return result['result']['markdown']
+            async with self._get_session().post(
+                self.api_url,
+                headers=headers,
+                data=image_data
+            ) as response:
+                if response.status != 200:
+                    raise Exception(f"OCR API请求失败: {response.status}")
+
+                result = await response.json()
+                if result.get('code') != 200:
+                    raise Exception(f"OCR处理失败: {result.get('message')}")
+
+                return result['result']['markdown']
         except Exception as e:
             raise Exception(f"OCR处理出错: {str(e)}")
 
@@ -46,11 +65,10 @@ class OCRService:
         :return: OCR识别结果文本
         """
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(image_url) as response:
-                    if response.status != 200:
-                        raise Exception(f"下载图片失败: {response.status}")
-                    image_data = await response.read()
-                    return await self.process_image(image_data)
+            async with self._get_session().get(image_url) as response:
+                if response.status != 200:
+                    raise Exception(f"下载图片失败: {response.status}")
+                image_data = await response.read()
+            return await self.process_image(image_data)
         except Exception as e:
             raise Exception(f"处理图片URL出错: {str(e)}")
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class PlainTextProgress:
+    """
+    以纯文本消息汇报处理进度：每次更新都发送一条新消息
+    """
+
+    def __init__(self, bot, chat_id: str):
+        self.bot = bot
+        self.chat_id = chat_id
+
+    async def status(self, text: str) -> None:
+        """当前阶段的提示"""
+        await self.bot.send_message(self.chat_id, "text", {"text": text})
+
+    async def section(self, title: str, text: str) -> None:
+        """某个阶段的结果"""
+        await self.bot.send_message(self.chat_id, "text", {"text": f"{title}：\n\n{text}"})
+
+    async def note(self, text: str) -> None:
+        """需要保留的附加信息"""
+        await self.bot.send_message(self.chat_id, "text", {"text": text})
+
+    async def finish(self) -> None:
+        pass
+
+
+class ProgressCard:
+    """
+    以单张可更新的消息卡片汇报处理进度：
+    第一次更新时发送卡片，之后的更新在防抖时间内合并后一次性更新卡片；
+    卡片发送或更新失败后不再更新，结束时改为发送一条文本消息
+    """
+
+    TRUNCATED_HINT = "\n\n……（内容过长，完整结果见笔记）"
+
+    def __init__(self, bot, chat_id: str, title: str, debounce: float, max_bytes: int):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.title = title
+        self.debounce = debounce
+        self.max_bytes = max_bytes
+        self._status = ""
+        self._sections: List[Tuple[str, str]] = []
+        self._notes: List[str] = []
+        self._done = False
+        self._dirty = False
+        self._failed = False
+        self._message_id: Optional[str] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def status(self, text: str) -> None:
+        self._status = text
+        await self._changed()
+
+    async def section(self, title: str, text: str) -> None:
+        self._sections.append((title, text))
+        await self._changed()
+
+    async def note(self, text: str) -> None:
+        self._notes.append(text)
+        await self._changed()
+
+    async def finish(self) -> None:
+        """立即发送最终状态"""
+        if self._message_id is None and not self._lock.locked() and not self._sections and not self._notes:
+            return
+        self._done = True
+        self._status = ""
+        self._dirty = True
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self._flush()
+
+        if self._failed:
+            await self._send_fallback()
+
+    async def _send_fallback(self) -> None:
+        """卡片无法更新时，发送一条文本消息告知结果保存位置"""
+        lines = ["处理进度卡片更新失败"] + (self._notes or ["结果未能显示"])
+        try:
+            await self.bot.send_message(self.chat_id, "text", {"text": "\n".join(lines)})
+        except Exception as e:
+            logger.error(f"发送进度文本消息失败: {e}")
+
+    async def _changed(self) -> None:
+        self._dirty = True
+        if self._message_id is None and not self._lock.locked():
+            # 第一次更新立即发送，让用户尽快看到反馈
+            await self._flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.debounce)
+        self._flush_task = None
+        await self._flush()
+
+    async def _flush(self) -> None:
+        async with self._lock:
+            if not self._dirty or self._failed:
+                return
+            self._dirty = False
+            card = self._render()
+            try:
+                if self._message_id is None:
+                    self._message_id = await self.bot.send_message(self.chat_id, "interactive", card)
+                else:
+                    await self.bot.patch_message(self._message_id, card)
+            except Exception as e:
+                logger.error(f"更新进度卡片失败，改用文本消息: {e}")
+                self._failed = True
+
+    def _render(self) -> Dict[str, Any]:
+        """生成卡片，超过字节上限时逐步截断最长的一段结果"""
+        sections = list(self._sections)
+        truncated = set()
+        card = self._build(sections, truncated)
+        size = self.bot.content_size(card)
+        while size > self.max_bytes:
+            longest = max(range(len(sections)), key=lambda i: len(sections[i][1]), default=None)
+            if longest is None or not sections[longest][1]:
+                break
+            title, text = sections[longest]
+            keep = int(len(text) * min(0.9, self.max_bytes / size))
+            sections[longest] = (title, text[:keep])
+            truncated.add(longest)
+            card = self._build(sections, truncated)
+            size = self.bot.content_size(card)
+        return card
+
+    def _build(self, sections: List[Tuple[str, str]], truncated: set) -> Dict[str, Any]:
+        elements: List[Dict[str, Any]] = []
+        if self._status:
+            elements.append({"tag": "div", "text": {"tag": "plain_text", "content": self._status}})
+        for idx, (title, text) in enumerate(sections):
+            if idx in truncated:
+                text += self.TRUNCATED_HINT
+            if elements:
+                elements.append({"tag": "hr"})
+            elements.append({"tag": "div", "text": {"tag": "lark_md", "content": f"**{title}**\n{text}"}})
+        if self._notes:
+            elements.append({"tag": "hr"})
+            elements.append({"tag": "note", "elements": [
+                {"tag": "plain_text", "content": note} for note in self._notes
+            ]})
+
+        return {
+            "config": {"wide_screen_mode": True, "update_multi": True},
+            "header": {
+                "title": {"tag": "plain_text", "content": self.title},
+                "template": "green" if self._done else "blue"
+            },
+            "elements": elements
+        }
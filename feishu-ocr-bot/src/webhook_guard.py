@@ -0,0 +1,206 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+import logging
+from collections import Counter, OrderedDict
+from typing import Dict, Any, Mapping
+from config.config import Config
+
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时退回标准库
+    orjson = None
+
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:  # 仅在收到加密事件时才需要
+    Cipher = None
+
+logger = logging.getLogger(__name__)
+
+
+def loads(data: bytes) -> Any:
+    """解析 JSON，优先使用 orjson"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class WebhookRejected(Exception):
+    """请求未通过准入检查"""
+
+    def __init__(self, reason: str, status_code: int = 400):
+        super().__init__(reason)
+        self.reason = reason
+        self.status_code = status_code
+
+
+class WebhookGuard:
+    """
+    飞书事件回调的准入控制：
+    在解析和记录日志之前完成大小限制、签名校验、时间窗口和防重放检查
+    """
+
+    def __init__(self):
+        self.encrypt_key = Config.FEISHU_ENCRYPT_KEY or ""
+        self.verification_token = Config.FEISHU_VERIFICATION_TOKEN
+        self.max_body_bytes = Config.FEISHU_MAX_BODY_BYTES
+        self.replay_window = Config.FEISHU_REPLAY_WINDOW_SECONDS
+        self.max_seen = Config.FEISHU_REPLAY_CACHE_SIZE
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self.accepted = 0
+        self.rejected: Counter = Counter()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回准入计数"""
+        return {"accepted": self.accepted, "rejected": dict(self.rejected)}
+
+    def _reject(self, reason: str, status_code: int = 400) -> WebhookRejected:
+        self.rejected[reason] += 1
+        logger.debug(f"拒绝飞书回调请求: {reason}")
+        return WebhookRejected(reason, status_code)
+
+    async def read_body(self, request) -> bytes:
+        """读取请求体，超过大小限制时立即中止"""
+        content_length = request.headers.get("content-length")
+        if content_length is not None:
+            try:
+                declared = int(content_length)
+            except ValueError:
+                raise self._reject("bad_content_length")
+            if declared > self.max_body_bytes:
+                raise self._reject("body_too_large", 413)
+
+        chunks = []
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > self.max_body_bytes:
+                raise self._reject("body_too_large", 413)
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def _check_signature(self, headers: Mapping[str, str], body: bytes) -> bool:
+        """
+        校验 X-Lark-Signature，返回请求是否带有签名
+        签名算法：sha256(timestamp + nonce + encrypt_key + body)
+        """
+        signature = headers.get("x-lark-signature", "")
+        timestamp = headers.get("x-lark-request-timestamp", "")
+        nonce = headers.get("x-lark-request-nonce", "")
+        if not signature:
+            return False
+
+        try:
+            request_time = int(timestamp)
+        except ValueError:
+            raise self._reject("bad_timestamp", 401)
+        if abs(time.time() - request_time) > self.replay_window:
+            raise self._reject("stale", 401)
+
+        expected = hashlib.sha256(
+            (timestamp + nonce + self.encrypt_key).encode("utf-8") + body
+        ).hexdigest()
+        if not hmac.compare_digest(expected.encode("utf-8"), signature.encode("utf-8")):
+            raise self._reject("bad_signature", 401)
+
+        if not self._remember(f"nonce:{timestamp}:{nonce}:{signature}"):
+            raise self._reject("replay", 401)
+        return True
+
+    def _remember(self, key: str) -> bool:
+        """记录已见过的请求，重复时返回 False"""
+        now = time.monotonic()
+        while self._seen:
+            expires_at = next(iter(self._seen.values()))
+            if expires_at > now and len(self._seen) < self.max_seen:
+                break
+            self._seen.popitem(last=False)
+
+        if key in self._seen:
+            return False
+        self._seen[key] = now + self.replay_window
+        return True
+
+    def _decrypt(self, encrypted: str) -> bytes:
+        """解密 FEISHU_ENCRYPT_KEY 加密的事件体（AES-256-CBC）"""
+        if Cipher is None:
+            logger.error("收到加密事件，但未安装 cryptography")
+            raise self._reject("decrypt_unavailable", 500)
+        if not self.encrypt_key:
+            raise self._reject("decrypt_failed")
+
+        try:
+            key = hashlib.sha256(self.encrypt_key.encode("utf-8")).digest()
+            raw = base64.b64decode(encrypted)
+            iv, ciphertext = raw[:16], raw[16:]
+            decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+            padded = decryptor.update(ciphertext) + decryptor.finalize()
+            pad = padded[-1]
+            if pad < 1 or pad > 16:
+                raise ValueError("invalid padding")
+            return padded[:-pad]
+        except Exception:
+            raise self._reject("decrypt_failed")
+
+    def admit(self, headers: Mapping[str, str], body: bytes) -> Dict[str, Any]:
+        """
+        对请求进行准入检查，通过后返回解析好的事件
+        未通过时抛出 WebhookRejected
+        """
+        signed = False
+        if self.encrypt_key:
+            signed = self._check_signature(headers, body)
+
+        try:
+            event = loads(body)
+            if isinstance(event, dict) and "encrypt" in event:
+                event = loads(self._decrypt(event["encrypt"]))
+        except WebhookRejected:
+            raise
+        except Exception:
+            raise self._reject("bad_json")
+        if not isinstance(event, dict):
+            raise self._reject("bad_json")
+
+        # 配置了加密密钥时，只有 URL 验证请求可以不带签名，其余请求在读取任何字段前拒绝
+        is_verification = event.get("type") == "url_verification"
+        if self.encrypt_key and not signed and not is_verification:
+            raise self._reject("missing_signature", 401)
+
+        header = event.get("header", {})
+        if not isinstance(header, dict):
+            raise self._reject("bad_json")
+        token = header.get("token") or event.get("token")
+
+        # 未签名的请求只能靠 Verification Token 校验来源
+        if not signed:
+            if not hmac.compare_digest(
+                str(token or "").encode("utf-8"), (self.verification_token or "").encode("utf-8")
+            ):
+                raise self._reject("bad_token", 401)
+
+            create_time = header.get("create_time")
+            if create_time and not is_verification:
+                try:
+                    event_time = int(create_time) / 1000
+                except (TypeError, ValueError):
+                    raise self._reject("bad_timestamp", 401)
+                if abs(time.time() - event_time) > self.replay_window:
+                    raise self._reject("stale", 401)
+
+        # 飞书会对同一事件重试投递，按 event_id 去重；处理失败时需调用 forget 允许重试
+        event_id = header.get("event_id")
+        if event_id and not self._remember(f"event:{event_id}"):
+            raise self._reject("duplicate", 200)
+
+        self.accepted += 1
+        return event
+
+    def forget(self, event: Dict[str, Any]) -> None:
+        """事件处理失败时移除去重记录，使飞书的重试投递能够再次被处理"""
+        event_id = (event.get("header") or {}).get("event_id")
+        if event_id:
+            self._seen.pop(f"event:{event_id}", None)